@@ -1,13 +1,24 @@
 import os
+import re
+import html
 import json
 import gspread
 import logging
-import pytz
 import asyncio
-from datetime import datetime
+import functools
+import time
+import random
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from zoneinfo import ZoneInfo
 from telegram import Update, MenuButtonCommands, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
+from telegram.error import BadRequest, Forbidden
 from telegram.ext import (
-    Application, CommandHandler, MessageHandler, ContextTypes,
+    AIORateLimiter, Application, CommandHandler, MessageHandler, ContextTypes,
     filters
 )
 
@@ -22,10 +33,20 @@ logger = logging.getLogger(__name__)
 BOT_TOKEN = os.environ.get("BOT_TOKEN")
 GOOGLE_CREDENTIALS_JSON = os.environ.get("GOOGLE_CREDENTIALS")
 GOOGLE_SHEET_NAME = "Pengaduan Global"
+
+# Webhook (opsional) - jika WEBHOOK_URL kosong, bot memakai polling
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")
+WEBHOOK_PATH = "webhook"
+PORT = int(os.environ.get("PORT", "8443"))
+# File snapshot state user, supaya pengaduan yang sedang diisi tidak hilang saat redeploy
+STATE_FILE = os.environ.get("STATE_FILE", "user_states.json")
+# File cadangan baris tiket yang gagal ditulis ke Sheets saat shutdown
+PENDING_ROWS_FILE = os.environ.get("PENDING_ROWS_FILE", "pending_rows.json")
 ADMIN_IDS = [5704050846, 8388423519, 5048153064]
 
 # Timezone Jakarta
-JAKARTA_TZ = pytz.timezone('Asia/Jakarta')
+JAKARTA_TZ = ZoneInfo('Asia/Jakarta')
 
 # Website configuration - HANYA INI YANG DITERIMA
 WEBSITES = {
@@ -36,84 +57,361 @@ WEBSITES = {
     'pasarliga': {'code': 'PL', 'name': 'PasarLiga'}
 }
 
-# Setup Google Sheets
-try:
+# Setup Google Sheets - koneksi lazy, dibuka saat pertama kali dibutuhkan
+_worksheet = None
+_worksheet_lock = asyncio.Lock()
+
+SHEETS_POOL_SIZE = 20
+# Thread pool khusus call gspread, seukuran pool koneksi Sheets - terpisah dari
+# default executor supaya call Sheets yang lambat tidak menahan pekerjaan lain
+_sheets_pool = ThreadPoolExecutor(max_workers=SHEETS_POOL_SIZE, thread_name_prefix="gspread")
+
+async def sheet_call(fn, *args, **kwargs):
+    """Jalankan call gspread (blocking) di thread pool Sheets"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_sheets_pool, functools.partial(fn, *args, **kwargs))
+
+def _connect_worksheet():
+    """Buka worksheet Google Sheets (blocking, jalankan di thread)"""
     gc = gspread.service_account_from_dict(json.loads(GOOGLE_CREDENTIALS_JSON))
+    # Pool koneksi keep-alive untuk semua call gspread dari worker thread.
+    # Retry hanya untuk method idempotent (default urllib3), append tidak diulang.
+    gc.session.mount("https://", HTTPAdapter(
+        pool_connections=SHEETS_POOL_SIZE,
+        pool_maxsize=SHEETS_POOL_SIZE,
+        max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[429, 500, 502, 503, 504])
+    ))
+    gc.session.headers["Connection"] = "keep-alive"
     sh = gc.open(GOOGLE_SHEET_NAME)
-    worksheet = sh.sheet1
-    logger.info("✅ Google Sheets connected successfully")
-except Exception as e:
-    logger.error(f"❌ Google Sheets connection failed: {e}")
-    worksheet = None
+    return sh.sheet1
+
+async def get_worksheet():
+    """Dapatkan worksheet, connect dulu jika belum - gagal connect bisa dicoba lagi"""
+    global _worksheet
+    if _worksheet is None:
+        async with _worksheet_lock:
+            if _worksheet is None:
+                try:
+                    _worksheet = await sheet_call(_connect_worksheet)
+                    logger.info("✅ Google Sheets connected successfully")
+                except Exception as e:
+                    logger.error("❌ Google Sheets connection failed: %s", e)
+                    raise
+    return _worksheet
+
+_warmup_task = None  # referensi disimpan supaya task tidak di-GC sebelum selesai
+
+async def _warmup_worksheet():
+    """Connect ke Google Sheets di background supaya bot langsung bisa melayani user"""
+    try:
+        await get_worksheet()
+        await prime_ticket_counts()
+    except Exception:
+        logger.warning("⚠️ Google Sheets belum terhubung, akan dicoba lagi saat dibutuhkan")
 
 # ===== KEYBOARD SETUP =====
-def get_main_menu_keyboard():
-    """Keyboard untuk menu utama"""
-    keyboard = [
+# ReplyKeyboardMarkup immutable, jadi cukup dibangun sekali dan dipakai semua user
+
+# Keyboard untuk menu utama
+MAIN_MENU_KEYBOARD = ReplyKeyboardMarkup(
+    [
         [KeyboardButton("📝 Buat Pengaduan Baru"), KeyboardButton("🔍 Cek Status Tiket")],
         [KeyboardButton("ℹ️ Cara Penggunaan"), KeyboardButton("🆘 Bantuan")]
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, input_field_placeholder="Pilih menu...")
+    ],
+    resize_keyboard=True, input_field_placeholder="Pilih menu..."
+)
 
-def get_cancel_only_keyboard():
-    """Keyboard dengan hanya tombol cancel"""
-    keyboard = [[KeyboardButton("❌ Batalkan Proses")]]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, input_field_placeholder="Ketik pesan Anda...")
+# Keyboard dengan hanya tombol cancel
+CANCEL_KEYBOARD = ReplyKeyboardMarkup(
+    [[KeyboardButton("❌ Batalkan Proses")]],
+    resize_keyboard=True, input_field_placeholder="Ketik pesan Anda..."
+)
 
-def get_skip_photo_keyboard():
-    """Keyboard untuk skip foto"""
-    keyboard = [
+# Keyboard untuk skip foto
+SKIP_PHOTO_KEYBOARD = ReplyKeyboardMarkup(
+    [
         [KeyboardButton("📸 Kirim Foto Bukti"), KeyboardButton("⏩ Lewati Tanpa Foto")],
         [KeyboardButton("❌ Batalkan Proses")]
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, input_field_placeholder="Pilih opsi...")
+    ],
+    resize_keyboard=True, input_field_placeholder="Pilih opsi..."
+)
+
+# ===== PESAN STATIS =====
+WELCOME_TEXT = (
+    "🎉 <b>Selamat datang di Layanan Pengaduan Customer Service!</b>\n\n"
+    "Kami siap membantu menyelesaikan masalah Anda.\n\n"
+    "👇 <b>Silakan pilih menu di bawah:</b>"
+)
+
+HELP_TEXT = (
+    "🆘 <b>Pusat Bantuan Customer Service</b>\n\n"
+    
+    "📋 <b>CARA BUAT PENGADUAN:</b>\n"
+    "1. Pilih <b>📝 Buat Pengaduan Baru</b>\n"
+    "2. Tulis <b>nama website</b> yang bermasalah\n"
+    "3. Isi <b>nama lengkap</b> Anda\n" 
+    "4. Masukkan <b>username/ID</b> di website tersebut\n"
+    "5. Jelaskan <b>keluhan</b> secara detail\n"
+    "6. Kirim <b>foto bukti</b> (jika ada)\n\n"
+    
+    "🔍 <b>CEK STATUS PENGADUAN:</b>\n"
+    "1. Pilih <b>🔍 Cek Status Tiket</b>\n"
+    "2. Masukkan <b>nomor tiket</b> yang diterima\n"
+    "3. Lihat status terbaru pengaduan\n\n"
+    
+    "💡 <b>INFORMASI PENTING:</b>\n"
+    "• Proses cepat & profesional\n"
+    "• Tim support siap membantu\n"
+    "• Simpan nomor tiket dengan baik\n"
+    
+    "❓ <b>MASIH BINGUNG?</b>\n"
+    "Gunakan tombol <b>📝 Buat Pengaduan Baru</b> untuk memulai!"
+)
+
+BUKTI_PROMPT_TEXT = (
+    "📸 <b>Bukti Pendukung (Opsional)</b>\n\n"
+    "Pilih opsi untuk bukti:\n\n"
+    "• 📸 Kirim Foto Bukti - Unggah foto/screenshot\n"
+    "• ⏩ Lewati Tanpa Foto - Lanjut tanpa bukti\n\n"
+    "💡 <b>Rekomendasi:</b> Foto bukti membantu proses penyelesaian lebih cepat!"
+)
+
+MENU_TEXT = (
+    "🤖 <b>Layanan Pengaduan Customer Service</b>\n\n"
+    "Kami siap membantu masalah Anda.\n\n"
+    "👇 <b>Silakan pilih menu:</b>"
+)
+
+BUAT_PENGADUAN_TEXT = (
+    "📝 <b>Membuat Pengaduan Baru</b>\n\n"
+    "Silakan tulis <b>nama website</b> tempat Anda mengalami masalah:\n\n"
+    "✍️ <b>Tulis nama website:</b>"
+)
+
+CEK_STATUS_TEXT = (
+    "🔍 <b>Cek Status Tiket Pengaduan</b>\n\n"
+    "Silakan masukkan <b>Nomor Tiket</b> yang Anda terima:\n\n"
+    "🎫 <b>Format tiket:</b> <code>KODE-TANGGAL-NOMOR</code>\n\n"
+    "✍️ <b>Ketik nomor tiket Anda:</b>"
+)
+
+CANCEL_TEXT = (
+    "❌ <b>Proses dibatalkan</b>\n\n"
+    "Kembali ke menu utama.\n\n"
+    "Silakan pilih menu yang diinginkan:"
+)
+
+TICKET_NOT_FOUND_TEXT = (
+    "❌ <b>Tiket tidak ditemukan.</b>\n\n"
+    "Pastikan:\n"
+    "• Nomor tiket benar\n"
+    "• Tidak ada typo\n"
+    "• Tiket milik Anda sendiri\n\n"
+    "Silakan coba lagi:"
+)
+
+PENGADUAN_PROCESSING_TEXT = (
+    "⏳ <b>Pengaduan Anda sedang disimpan...</b>\n\n"
+    "Mohon tunggu sebentar, nomor tiket akan segera dikirim."
+)
 
 # Helper functions
+# Cache (detik epoch, timestamp, DDMMYYYY) - format ulang paling banyak sekali per detik
+_time_cache = (None, "", "")
+
+def _jakarta_now_strings():
+    """Timestamp & tanggal Jakarta terformat, di-cache per detik"""
+    global _time_cache
+    second = int(time.time())
+    if _time_cache[0] != second:
+        now = datetime.now(JAKARTA_TZ)
+        _time_cache = (second, now.strftime("%d/%m/%Y %H:%M:%S"), now.strftime("%d%m%Y"))
+    return _time_cache
+
 def get_jakarta_time():
     """Dapatkan waktu Jakarta sekarang"""
-    return datetime.now(JAKARTA_TZ).strftime("%d/%m/%Y %H:%M:%S")
+    return _jakarta_now_strings()[1]
 
-def generate_ticket_number(website_code):
-    """Generate ticket number berdasarkan kode website"""
-    try:
-        all_data = worksheet.get_all_records()
-        today = datetime.now(JAKARTA_TZ).strftime("%d%m%Y")  # DDMMYYYY
+def get_today_ddmmyyyy():
+    """Dapatkan tanggal Jakarta hari ini (DDMMYYYY) untuk nomor tiket"""
+    return _jakarta_now_strings()[2]
+
+# Counter tiket per (kode website, DDMMYYYY) - diprime sekali per hari dari kolom Ticket ID
+_ticket_counts = {}
+_ticket_counts_day = None
+_ticket_counts_lock = asyncio.Lock()
+
+# Format tiket KODE-DDMMYYYY-NNN, dikompilasi sekali
+TICKET_ID_RE = re.compile(r"^([A-Z]+)-(\d{8})-(\d+)$")
+
+async def _prime_ticket_counts(today):
+    """Isi ulang counter tiket dari kolom Ticket ID (satu kali per hari)"""
+    global _ticket_counts_day
+    worksheet = await get_worksheet()
+    # Salin sebelum read: baris yang selesai ditulis selama read berlangsung sudah
+    # keluar dari _unflushed_tickets tapi belum tentu ada di hasil read
+    unflushed_ids = list(_unflushed_tickets)
+    ticket_ids = await sheet_call(
+        worksheet.get, "B2:B", value_render_option="UNFORMATTED_VALUE"
+    )
+    # Pakai nomor urut terbesar (bukan jumlah baris) supaya baris yang dihapus
+    # tidak membuat nomor tiket dipakai ulang; tiket di antrian tulis ikut dihitung.
+    # Counter hari ini yang sudah ada di memory juga ikut (max), tidak di-reset
+    counts = {key: count for key, count in _ticket_counts.items() if key[1] == today}
+    all_ids = [str(row[0]) for row in ticket_ids if row]
+    all_ids.extend(unflushed_ids)
+    for tid in all_ids:
+        match = TICKET_ID_RE.match(tid.strip())
+        if match and match.group(2) == today:
+            key = (match.group(1), today)
+            counts[key] = max(counts.get(key, 0), int(match.group(3)))
+    _ticket_counts.clear()
+    _ticket_counts.update(counts)
+    _ticket_counts_day = today
+
+async def prime_ticket_counts():
+    """Prime counter tiket hari ini saat startup supaya tiket pertama tidak menunggu read sheet"""
+    today = get_today_ddmmyyyy()
+    async with _ticket_counts_lock:
+        if _ticket_counts_day != today:
+            await _prime_ticket_counts(today)
+
+async def generate_ticket_number(website_code):
+    """Generate ticket number berdasarkan kode website - raise jika nomor terakhir tidak diketahui"""
+    today = get_today_ddmmyyyy()
+    async with _ticket_counts_lock:
+        if _ticket_counts_day != today:
+            try:
+                await _prime_ticket_counts(today)
+            except Exception as e:
+                if _ticket_counts_day is None:
+                    # Belum pernah diprime: nomor terakhir di sheet tidak diketahui,
+                    # menebak nomor bisa menghasilkan Ticket ID ganda
+                    logger.error("Error generating ticket: %s", e)
+                    raise
+                # Ganti hari saat Sheets gagal: semua tiket hari ini dibuat proses ini
+                # (counter + _unflushed_tickets), jadi counter in-memory aman dipakai.
+                # _ticket_counts_day tidak diubah supaya priming dicoba lagi di tiket berikutnya
+                logger.warning("⚠️ Priming ticket counter failed, using in-memory counter: %s", e)
         
         # Hitung tiket hari ini untuk website tertentu
-        count_today = sum(1 for row in all_data 
-                         if str(row.get('Ticket ID', '')).startswith(f"{website_code}-{today}"))
-        
-        return f"{website_code}-{today}-{count_today+1:03d}"
-    except Exception as e:
-        logger.error(f"Error generating ticket: {e}")
-        return f"{website_code}-{datetime.now(JAKARTA_TZ).strftime('%d%m%Y')}-001"
+        key = (website_code, today)
+        _ticket_counts[key] = _ticket_counts.get(key, 0) + 1
+        return f"{website_code}-{today}-{_ticket_counts[key]:03d}"
+
+# Index Ticket ID -> record untuk cek status, di-refresh tiap TICKET_INDEX_TTL detik
+TICKET_INDEX_TTL = 60  # detik
+_ticket_index = {}
+_ticket_index_ts = 0.0
+_unflushed_tickets = {}  # tiket baru yang masih di antrian tulis
+
+_ticket_index_lock = asyncio.Lock()
+
+def _ticket_index_expired():
+    return time.monotonic() - _ticket_index_ts > TICKET_INDEX_TTL
+
+# Kolom yang dibutuhkan cek status: range sheet -> nama field (urutan kolom = urutan append)
+STATUS_RANGES = {
+    "A2:F": ['Timestamp', 'Ticket ID', 'Nama Website', 'Nama', 'Username Website', 'Keluhan'],
+    "I2:I": ['User_ID'],
+    "L2:L": ['Status'],
+}
+
+async def _refresh_ticket_index():
+    """Bangun ulang index dari kolom yang dibutuhkan saja (bukan seluruh sheet)"""
+    global _ticket_index, _ticket_index_ts
+    worksheet = await get_worksheet()
+    # Salin sebelum read: tiket yang selesai ditulis selama batch_get berlangsung sudah
+    # keluar dari _unflushed_tickets tapi belum tentu ada di hasil read
+    unflushed = dict(_unflushed_tickets)
+    ranges = await sheet_call(
+        worksheet.batch_get, list(STATUS_RANGES), value_render_option="UNFORMATTED_VALUE"
+    )
+    # Sheets tidak mengembalikan sel/baris kosong di akhir range, jadi tiap range dipadatkan
+    all_fields = [field for fields in STATUS_RANGES.values() for field in fields]
+    records = [dict.fromkeys(all_fields, "") for _ in ranges[0]]
+    for fields, values in zip(STATUS_RANGES.values(), ranges):
+        for record, row in zip(records, values):
+            for i, field in enumerate(fields):
+                record[field] = row[i] if i < len(row) else ""
+    index = {str(record.get('Ticket ID', '')): record for record in records}
+    # Tiket yang belum tertulis ke sheet jangan sampai hilang dari index
+    for tid, record in unflushed.items():
+        index.setdefault(tid, record)
+    for tid, record in _unflushed_tickets.items():
+        index.setdefault(tid, record)
+    _ticket_index = index
+    _ticket_index_ts = time.monotonic()
+
+async def get_ticket_record(ticket_id):
+    """Cari record tiket dari index in-memory, refresh dari sheet jika sudah kedaluwarsa"""
+    if _ticket_index_expired():
+        # Satu refresh untuk banyak cek status bersamaan - hemat kuota read Sheets
+        async with _ticket_index_lock:
+            if _ticket_index_expired():
+                await _refresh_ticket_index()
+    return _ticket_index.get(ticket_id)
+
+def index_new_ticket(row):
+    """Masukkan tiket baru ke index supaya langsung bisa dicek tanpa refetch"""
+    record = {
+        'Timestamp': row[0],
+        'Ticket ID': row[1],
+        'Nama Website': row[2],
+        'Nama': row[3],
+        'Username Website': row[4],
+        'Keluhan': row[5],
+        'User_ID': row[8],
+        'Status': row[11],
+    }
+    _ticket_index[row[1]] = record
+    _unflushed_tickets[row[1]] = record
+
+# Lookup website berdasarkan key & nama (lowercase), dibangun sekali saat module load
+_WEBSITE_LOOKUP = {
+    alias: (info['name'], info['code'])
+    for key, info in WEBSITES.items()
+    for alias in (key.lower(), info['name'].lower())
+}
+_WEBSITE_RE = re.compile(
+    '|'.join(re.escape(k) for k in sorted(_WEBSITE_LOOKUP, key=len, reverse=True)),
+    re.IGNORECASE
+)
 
 def validate_website_input(user_input):
     """Validasi input website customer - HARUS SESUAI KRITERIA"""
     user_input_lower = user_input.lower().strip()
     
-    # Cek apakah input user cocok dengan website yang ada
-    for key, info in WEBSITES.items():
-        if (key in user_input_lower or 
-            info['name'].lower() in user_input_lower or
-            user_input_lower in key or 
-            user_input_lower in info['name'].lower()):
-            return info['name'], info['code']
+    # Input persis nama website
+    result = _WEBSITE_LOOKUP.get(user_input_lower)
+    if result:
+        return result
+    
+    # Input mengandung nama website
+    match = _WEBSITE_RE.search(user_input_lower)
+    if match:
+        return _WEBSITE_LOOKUP[match.group(0)]
+    
+    # Input berupa potongan nama website (mis. "joker")
+    for key, result in _WEBSITE_LOOKUP.items():
+        if user_input_lower in key:
+            return result
     
     return None, None
 
+_HTML_TRANS = str.maketrans({
+    '&': '&amp;',
+    '<': '&lt;',
+    '>': '&gt;',
+    '"': '&quot;',
+    "'": '&#39;'
+})
+
 def escape_html(text):
     """Escape karakter khusus HTML"""
     if not text:
         return ""
-    escape_chars = {
-        '&': '&amp;',
-        '<': '&lt;',
-        '>': '&gt;',
-        '"': '&quot;',
-        "'": '&#39;'
-    }
-    return ''.join(escape_chars.get(char, char) for char in str(text))
+    return str(text).translate(_HTML_TRANS)
 
 def get_user_contact_info(user):
     """Dapatkan informasi kontak user dengan handle username yang tidak ada"""
@@ -144,37 +442,233 @@ def get_user_contact_info(user):
     }
 
 # ===== STATE MANAGEMENT YANG DIPERBAIKI =====
-user_states = {}
-user_locks = {}  # Lock untuk setiap user
+@dataclass(slots=True)
+class UserState:
+    """State percakapan satu user, termasuk lock-nya"""
+    mode: str | None = None
+    step: str | None = None
+    data: dict = field(default_factory=dict)
+    last_activity: datetime = field(default_factory=lambda: datetime.now(JAKARTA_TZ))
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+MAX_USER_STATES = 10000
+user_states = OrderedDict()  # urutan LRU: paling lama tidak aktif di depan
 
 def get_user_lock(user_id):
     """Dapatkan lock untuk user tertentu"""
-    if user_id not in user_locks:
-        user_locks[user_id] = asyncio.Lock()
-    return user_locks[user_id]
+    return get_user_state(user_id).lock
 
 def get_user_state(user_id):
     """Dapatkan state user dengan default values - THREAD SAFE"""
-    if user_id not in user_states:
-        user_states[user_id] = {
-            "mode": None,
-            "step": None,
-            "data": {},
-            "last_activity": datetime.now()
-        }
-    return user_states[user_id]
+    user_state = user_states.get(user_id)
+    if user_state is None:
+        user_state = user_states[user_id] = UserState()
+        if len(user_states) > MAX_USER_STATES:
+            _evict_lru_states()
+    return user_state
+
+def _evict_lru_states():
+    """Buang state paling lama tidak aktif sampai jumlahnya kembali di bawah batas"""
+    for uid in list(user_states):
+        if len(user_states) <= MAX_USER_STATES:
+            break
+        if not user_states[uid].lock.locked():
+            del user_states[uid]
+
+def reset_user_state(user_id, mode, step=None):
+    """Mulai ulang state user dengan mode/step baru - lock user tetap sama"""
+    user_state = get_user_state(user_id)
+    user_state.mode = mode
+    user_state.step = step
+    user_state.data = {}
+    update_user_activity(user_id)
+    return user_state
 
 def clear_user_state(user_id):
     """Clear state user - THREAD SAFE"""
-    if user_id in user_states:
-        del user_states[user_id]
-    if user_id in user_locks:
-        del user_locks[user_id]
+    user_states.pop(user_id, None)
 
 def update_user_activity(user_id):
     """Update waktu aktivitas terakhir user"""
-    if user_id in user_states:
-        user_states[user_id]["last_activity"] = datetime.now()
+    user_state = user_states.get(user_id)
+    if user_state is not None:
+        user_state.last_activity = datetime.now(JAKARTA_TZ)
+        user_states.move_to_end(user_id)
+
+STATE_TTL = timedelta(minutes=30)
+STATE_EVICT_INTERVAL = 60  # detik
+_evict_task = None
+
+def evict_idle_states():
+    """Hapus state user yang tidak aktif lebih lama dari STATE_TTL"""
+    cutoff = datetime.now(JAKARTA_TZ) - STATE_TTL
+    idle_users = [
+        uid for uid, state in user_states.items()
+        if state.last_activity < cutoff and not state.lock.locked()
+    ]
+    for uid in idle_users:
+        clear_user_state(uid)
+    return len(idle_users)
+
+async def _evict_loop():
+    """Background task: bersihkan state user yang ditinggal di tengah proses"""
+    while True:
+        await asyncio.sleep(STATE_EVICT_INTERVAL)
+        evicted = evict_idle_states()
+        if evicted:
+            logger.info("🧹 Evicted %s idle user state(s)", evicted)
+
+def save_user_states():
+    """Simpan state user yang masih aktif ke STATE_FILE (dipanggil saat shutdown)"""
+    snapshot = {
+        str(uid): {
+            "mode": state.mode,
+            "step": state.step,
+            "data": state.data,
+            "last_activity": state.last_activity.isoformat(),
+        }
+        for uid, state in user_states.items()
+        # State "completed" datanya sudah diambil selesaikan_pengaduan - tidak perlu disimpan
+        if state.step != "completed"
+    }
+    try:
+        tmp_path = f"{STATE_FILE}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, STATE_FILE)
+        logger.info("💾 Saved %s user state(s)", len(snapshot))
+    except Exception as e:
+        logger.error("Error saving user states: %s", e)
+
+def load_user_states():
+    """Muat state user dari STATE_FILE, lewati yang sudah melewati STATE_TTL"""
+    try:
+        with open(STATE_FILE, encoding="utf-8") as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        logger.error("Error loading user states: %s", e)
+        return
+    
+    cutoff = datetime.now(JAKARTA_TZ) - STATE_TTL
+    restored = []
+    for uid, saved in snapshot.items():
+        last_activity = datetime.fromisoformat(saved["last_activity"])
+        if last_activity >= cutoff:
+            restored.append((int(uid), UserState(
+                mode=saved["mode"],
+                step=saved["step"],
+                data=saved["data"],
+                last_activity=last_activity,
+            )))
+    # Urutkan supaya urutan LRU user_states tetap benar
+    restored.sort(key=lambda item: item[1].last_activity)
+    user_states.update(restored[-MAX_USER_STATES:])
+    logger.info("💾 Restored %s user state(s)", len(user_states))
+
+# ===== ANTRIAN TULIS GOOGLE SHEETS =====
+SHEET_FLUSH_BATCH_SIZE = 20
+SHEET_FLUSH_INTERVAL = 0.5  # detik - jendela pengumpulan batch
+SHEET_RETRY_DELAY = 5  # detik - jeda sebelum batch gagal dicoba lagi
+pending_rows = asyncio.Queue()
+_flush_buffer = []  # baris yang sudah diambil dari antrian tapi belum tertulis
+_flush_task = None
+_FLUSH_STOP = object()  # sentinel antrian: minta _flush_loop berhenti setelah write terakhir
+
+async def _write_rows(rows):
+    """Tulis beberapa baris sekaligus ke Google Sheets"""
+    worksheet = await get_worksheet()
+    await sheet_call(
+        worksheet.append_rows,
+        rows,
+        value_input_option="RAW",
+        insert_data_option="INSERT_ROWS",
+        include_values_in_response=False
+    )
+    for row in rows:
+        _unflushed_tickets.pop(row[1], None)
+    logger.info("✅ %s row(s) saved to Google Sheets", len(rows))
+
+async def _flush_loop():
+    """Background task: kumpulkan baris dari antrian lalu tulis via append_rows.
+    Berhenti sendiri setelah menerima _FLUSH_STOP - jangan di-cancel, karena write
+    yang sedang berjalan di thread gspread tetap selesai walau task-nya dibatalkan"""
+    loop = asyncio.get_running_loop()
+    rows = _flush_buffer
+    stopping = False
+    while not stopping:
+        if not rows:
+            row = await pending_rows.get()
+            if row is _FLUSH_STOP:
+                break
+            rows.append(row)
+        deadline = loop.time() + SHEET_FLUSH_INTERVAL
+        while len(rows) < SHEET_FLUSH_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                row = await asyncio.wait_for(pending_rows.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if row is _FLUSH_STOP:
+                stopping = True
+                break
+            rows.append(row)
+        
+        try:
+            await _write_rows(rows)
+            rows.clear()
+        except Exception as e:
+            # Baris tetap disimpan dan dicoba lagi pada putaran berikutnya
+            # (atau oleh flush_pending_rows saat shutdown)
+            logger.error("❌ Failed to save %s row(s) to Google Sheets: %s", len(rows), e)
+            if not stopping:
+                await asyncio.sleep(SHEET_RETRY_DELAY)
+
+async def flush_pending_rows():
+    """Tulis semua baris yang masih tersisa di antrian (dipakai saat shutdown, setelah _flush_loop berhenti)"""
+    rows = _flush_buffer
+    while not pending_rows.empty():
+        row = pending_rows.get_nowait()
+        if row is not _FLUSH_STOP:
+            rows.append(row)
+    if rows:
+        try:
+            await _write_rows(rows)
+            rows.clear()
+        except Exception as e:
+            logger.error("❌ Failed to flush %s row(s) on shutdown: %s", len(rows), e)
+            save_pending_rows(rows)
+
+def save_pending_rows(rows):
+    """Simpan baris yang belum tertulis ke PENDING_ROWS_FILE supaya tidak hilang saat restart"""
+    try:
+        tmp_path = f"{PENDING_ROWS_FILE}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(rows, f)
+        os.replace(tmp_path, PENDING_ROWS_FILE)
+        logger.info("💾 Saved %s unflushed row(s)", len(rows))
+    except Exception as e:
+        logger.error("Error saving unflushed rows: %s", e)
+
+def load_pending_rows():
+    """Masukkan kembali baris dari PENDING_ROWS_FILE ke antrian tulis"""
+    try:
+        with open(PENDING_ROWS_FILE, encoding="utf-8") as f:
+            rows = json.load(f)
+        os.remove(PENDING_ROWS_FILE)
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        logger.error("Error loading unflushed rows: %s", e)
+        return
+    
+    for row in rows:
+        pending_rows.put_nowait(row)
+        index_new_ticket(row)
+    logger.info("💾 Re-queued %s unflushed row(s)", len(rows))
 
 # ===== MENU BUTTON HANDLERS =====
 async def setup_menu_button(application: Application):
@@ -185,7 +679,7 @@ async def setup_menu_button(application: Application):
         )
         logger.info("✅ Menu button commands berhasil diatur")
     except Exception as e:
-        logger.error(f"❌ Gagal mengatur menu button: {e}")
+        logger.error("❌ Gagal mengatur menu button: %s", e)
 
 async def set_commands_menu(application: Application):
     """Set daftar commands yang akan muncul di menu button"""
@@ -201,13 +695,36 @@ async def set_commands_menu(application: Application):
         await application.bot.set_my_commands(commands)
         logger.info("✅ Menu commands berhasil diatur")
     except Exception as e:
-        logger.error(f"❌ Gagal mengatur menu commands: {e}")
+        logger.error("❌ Gagal mengatur menu commands: %s", e)
 
 # ===== POST INIT FUNCTION =====
 async def post_init(application: Application):
     """Setup setelah bot diinisialisasi"""
+    global _flush_task, _evict_task, _warmup_task
+    load_user_states()
+    load_pending_rows()
     await set_commands_menu(application)
     await setup_menu_button(application)
+    _warmup_task = asyncio.create_task(_warmup_worksheet())
+    _flush_task = asyncio.create_task(_flush_loop())
+    _evict_task = asyncio.create_task(_evict_loop())
+
+async def post_shutdown(application: Application):
+    """Hentikan background task dan tulis sisa antrian sebelum bot mati"""
+    if _warmup_task:
+        _warmup_task.cancel()
+    if _evict_task:
+        _evict_task.cancel()
+    if _flush_task:
+        # Hentikan loop lewat sentinel & tunggu write yang sedang berjalan, supaya
+        # _flush_buffer hanya berisi baris yang benar-benar belum tertulis
+        await pending_rows.put(_FLUSH_STOP)
+        try:
+            await _flush_task
+        except Exception as e:
+            logger.error("❌ Flush task failed: %s", e)
+    await flush_pending_rows()
+    save_user_states()
 
 # ===== HANDLERS =====
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -215,21 +732,12 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
     
     async with get_user_lock(user_id):
-        clear_user_state(user_id)
-        user_state = get_user_state(user_id)
-        user_state["mode"] = "menu"
-        update_user_activity(user_id)
-    
-    welcome_text = (
-        "🎉 <b>Selamat datang di Layanan Pengaduan Customer Service!</b>\n\n"
-        "Kami siap membantu menyelesaikan masalah Anda.\n\n"
-        "👇 <b>Silakan pilih menu di bawah:</b>"
-    )
+        reset_user_state(user_id, "menu")
     
     await update.message.reply_text(
-        welcome_text,
+        WELCOME_TEXT,
         parse_mode="HTML",
-        reply_markup=get_main_menu_keyboard()
+        reply_markup=MAIN_MENU_KEYBOARD
     )
 
 async def handle_buat_pengaduan(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -237,18 +745,12 @@ async def handle_buat_pengaduan(update: Update, context: ContextTypes.DEFAULT_TY
     user_id = update.message.from_user.id
     
     async with get_user_lock(user_id):
-        clear_user_state(user_id)
-        user_state = get_user_state(user_id)
-        user_state["mode"] = "pengaduan"
-        user_state["step"] = "nama_website"
-        update_user_activity(user_id)
+        reset_user_state(user_id, "pengaduan", "nama_website")
     
     await update.message.reply_text(
-        "📝 <b>Membuat Pengaduan Baru</b>\n\n"
-        "Silakan tulis <b>nama website</b> tempat Anda mengalami masalah:\n\n"
-        "✍️ <b>Tulis nama website:</b>",
+        BUAT_PENGADUAN_TEXT,
         parse_mode="HTML",
-        reply_markup=get_cancel_only_keyboard()
+        reply_markup=CANCEL_KEYBOARD
     )
 
 async def handle_cek_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -256,55 +758,20 @@ async def handle_cek_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
     
     async with get_user_lock(user_id):
-        clear_user_state(user_id)
-        user_state = get_user_state(user_id)
-        user_state["mode"] = "cek_status"
-        user_state["step"] = "input_tiket"
-        update_user_activity(user_id)
+        reset_user_state(user_id, "cek_status", "input_tiket")
     
     await update.message.reply_text(
-        "🔍 <b>Cek Status Tiket Pengaduan</b>\n\n"
-        "Silakan masukkan <b>Nomor Tiket</b> yang Anda terima:\n\n"
-        "🎫 <b>Format tiket:</b> <code>KODE-TANGGAL-NOMOR</code>\n\n"
-        "✍️ <b>Ketik nomor tiket Anda:</b>",
+        CEK_STATUS_TEXT,
         parse_mode="HTML",
-        reply_markup=get_cancel_only_keyboard()
+        reply_markup=CANCEL_KEYBOARD
     )
 
 async def handle_bantuan(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Menu bantuan"""
-    user_id = update.message.from_user.id
-    user_info = get_user_contact_info(update.message.from_user)
-    
-    help_text = (
-        "🆘 <b>Pusat Bantuan Customer Service</b>\n\n"
-        
-        "📋 <b>CARA BUAT PENGADUAN:</b>\n"
-        "1. Pilih <b>📝 Buat Pengaduan Baru</b>\n"
-        "2. Tulis <b>nama website</b> yang bermasalah\n"
-        "3. Isi <b>nama lengkap</b> Anda\n" 
-        "4. Masukkan <b>username/ID</b> di website tersebut\n"
-        "5. Jelaskan <b>keluhan</b> secara detail\n"
-        "6. Kirim <b>foto bukti</b> (jika ada)\n\n"
-        
-        "🔍 <b>CEK STATUS PENGADUAN:</b>\n"
-        "1. Pilih <b>🔍 Cek Status Tiket</b>\n"
-        "2. Masukkan <b>nomor tiket</b> yang diterima\n"
-        "3. Lihat status terbaru pengaduan\n\n"
-        
-        "💡 <b>INFORMASI PENTING:</b>\n"
-        "• Proses cepat & profesional\n"
-        "• Tim support siap membantu\n"
-        "• Simpan nomor tiket dengan baik\n"
-        
-        "❓ <b>MASIH BINGUNG?</b>\n"
-        "Gunakan tombol <b>📝 Buat Pengaduan Baru</b> untuk memulai!"
-    )
-    
     await update.message.reply_text(
-        help_text,
+        HELP_TEXT,
         parse_mode="HTML",
-        reply_markup=get_main_menu_keyboard()
+        reply_markup=MAIN_MENU_KEYBOARD
     )
 
 async def handle_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -312,82 +779,101 @@ async def handle_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.message.from_user.id
     
     async with get_user_lock(user_id):
-        clear_user_state(user_id)
-        user_state = get_user_state(user_id)
-        user_state["mode"] = "menu"
-        update_user_activity(user_id)
+        reset_user_state(user_id, "menu")
     
     await update.message.reply_text(
-        "❌ <b>Proses dibatalkan</b>\n\n"
-        "Kembali ke menu utama.\n\n"
-        "Silakan pilih menu yang diinginkan:",
+        CANCEL_TEXT,
         parse_mode="HTML",
-        reply_markup=get_main_menu_keyboard()
+        reply_markup=MAIN_MENU_KEYBOARD
     )
 
+# Tombol navigasi utama & alias command -> handler
+BUTTON_DISPATCH = {
+    "📝 Buat Pengaduan Baru": handle_buat_pengaduan,
+    "/buat_pengaduan": handle_buat_pengaduan,
+    "🔍 Cek Status Tiket": handle_cek_status,
+    "/cek_status": handle_cek_status,
+    "ℹ️ Cara Penggunaan": handle_bantuan,
+    "🆘 Bantuan": handle_bantuan,
+    "/bantuan": handle_bantuan,
+    "/help": handle_bantuan,
+    "❌ Batalkan Proses": handle_cancel,
+    "/cancel": handle_cancel,
+    "cancel": handle_cancel,
+    "batal": handle_cancel,
+}
+
+# Satu regex (dikompilasi sekali) untuk semua tombol navigasi - dipakai filter MessageHandler
+BUTTON_RE = re.compile(
+    r"^\s*(?:" + "|".join(re.escape(label) for label in BUTTON_DISPATCH) + r")\s*$"
+)
+
+async def handle_menu_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle tombol navigasi utama - TANPA LOCK (hanya read)"""
+    await BUTTON_DISPATCH[update.message.text.strip()](update, context)
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle semua pesan text dengan state management yang DIPERBAIKI"""
     user_message = update.message.text.strip()
     user_id = update.message.from_user.id
     
-    # Handle tombol navigasi utama - TANPA LOCK (hanya read)
-    if user_message in ["📝 Buat Pengaduan Baru", "/buat_pengaduan"]:
-        await handle_buat_pengaduan(update, context)
-        return
-    elif user_message in ["🔍 Cek Status Tiket", "/cek_status"]:
-        await handle_cek_status(update, context)
-        return
-    elif user_message in ["ℹ️ Cara Penggunaan", "🆘 Bantuan", "/bantuan", "/help"]:
-        await handle_bantuan(update, context)
-        return
-    elif user_message in ["❌ Batalkan Proses", "/cancel", "cancel", "batal"]:
-        await handle_cancel(update, context)
-        return
-    
     # Handle tombol konfirmasi bukti - PERBAIKAN DI SINI
     if user_message in ["📸 Kirim Foto Bukti", "⏩ Lewati Tanpa Foto"]:
         await handle_bukti_selection(update, context, user_message, user_id)
         return
     
-    # Dapatkan state user dengan lock
-    async with get_user_lock(user_id):
-        user_state = get_user_state(user_id)
-        mode = user_state.get("mode")
-        step = user_state.get("step")
-        update_user_activity(user_id)
+    # Baca state tanpa lock - tidak ada await di antara baca & clear, jadi tetap atomic
+    # di event loop. Lock baru diambil di handler flow yang memutasi state.
+    user_state = user_states.get(user_id)
+    mode = user_state.mode if user_state else None
+    step = user_state.step if user_state else None
+    is_pengaduan = mode == "pengaduan"
+    is_cek_status = mode == "cek_status" and step == "input_tiket"
+    if not (is_pengaduan or is_cek_status):
+        clear_user_state(user_id)
     
-    logger.info(f"User {user_id} message: {user_message}, mode: {mode}, step: {step}")
+    logger.info("User %s message: %s, mode: %s, step: %s", user_id, user_message, mode, step)
     
     # Handle berdasarkan mode dengan lock yang sesuai
-    if mode == "pengaduan":
+    if is_pengaduan:
         await handle_pengaduan_flow(update, context, user_message, user_id)
-    elif mode == "cek_status" and step == "input_tiket":
+    elif is_cek_status:
         await proses_cek_status(update, context, user_message, user_id)
     else:
-        logger.warning(f"Unknown state for user {user_id}: mode={mode}, step={step}")
-        async with get_user_lock(user_id):
-            clear_user_state(user_id)
+        logger.warning("Unknown state for user %s: mode=%s, step=%s", user_id, mode, step)
         await show_menu(update, context)
 
 async def handle_bukti_selection(update: Update, context: ContextTypes.DEFAULT_TYPE, selection: str, user_id: int):
     """Handle pemilihan opsi bukti - VERSI DIPERBAIKI"""
-    logger.info(f"Handling bukti selection for user {user_id}: {selection}")
+    logger.info("Handling bukti selection for user %s: %s", user_id, selection)
     
     if selection == "📸 Kirim Foto Bukti":
         await update.message.reply_text(
             "📸 <b>Silakan kirim foto bukti sekarang:</b>\n\n"
             "📎 <b>Unggah foto dari galeri Anda...</b>",
             parse_mode="HTML",
-            reply_markup=get_cancel_only_keyboard()
+            reply_markup=CANCEL_KEYBOARD
         )
     elif selection == "⏩ Lewati Tanpa Foto":
-        # PERBAIKAN: Update state sebelum melanjutkan
+        # Cek step, tandai completed & ambil data dalam satu lock - update lain dari
+        # user yang sama (concurrent_updates) tidak bisa menyela di antaranya
+        data = None
         async with get_user_lock(user_id):
             user_state = get_user_state(user_id)
-            user_state["data"]["bukti"] = "Tidak ada bukti foto"
-            user_state["step"] = "completed"  # Mark as completed to prevent stuck
-            update_user_activity(user_id)
-            logger.info(f"User {user_id} memilih tanpa foto, state updated")
+            is_completed = user_state.step == "completed"
+            if user_state.mode == "pengaduan" and user_state.step == "bukti":
+                user_state.data["bukti"] = "Tidak ada bukti foto"
+                data = take_completed_data(user_id)
+                logger.info("User %s memilih tanpa foto, state updated", user_id)
+            elif not is_completed:
+                clear_user_state(user_id)
+        
+        if data is None:
+            if is_completed:
+                await reply_pengaduan_processing(update)
+            else:
+                await show_menu(update, context)
+            return
         
         await update.message.reply_text(
             "⏩ <b>Melanjutkan tanpa foto bukti...</b>",
@@ -395,216 +881,222 @@ async def handle_bukti_selection(update: Update, context: ContextTypes.DEFAULT_T
             reply_markup=ReplyKeyboardRemove()
         )
         
-        # Beri sedikit delay untuk memastikan state tersimpan
-        await asyncio.sleep(1)
-        
-        await selesaikan_pengaduan(update, context, user_id)
+        await selesaikan_pengaduan(update, context, user_id, data)
+
+# ===== STEP PENGADUAN =====
+# Setiap step: update state (dipanggil di dalam lock user), return (reply_text, reply_markup)
+
+def step_nama_website(update: Update, user_state: UserState, user_message: str):
+    """Step 1: validasi nama website"""
+    website_name, website_code = validate_website_input(user_message)
+    
+    if not (website_name and website_code):
+        # Website tidak valid, minta input ulang
+        return (
+            "❌ <b>Website tidak valid!</b>\n\n"
+            "Silakan tulis <b>nama website</b> yang sesuai:\n\n"
+            "✍️ <b>Tulis nama website yang benar:</b>"
+        ), CANCEL_KEYBOARD
+    
+    # Website valid, lanjutkan
+    user_state.data["website_name"] = website_name
+    user_state.data["website_code"] = website_code
+    user_state.step = "nama"
+    return (
+        f"<b>{website_name}</b>\n\n"
+        "Silakan kirim <b>Nama Lengkap</b> Anda:\n\n"
+        "✍️ <b>Ketik nama lengkap:</b>"
+    ), CANCEL_KEYBOARD
+
+def step_nama(update: Update, user_state: UserState, user_message: str):
+    """Step 2: nama lengkap + info kontak Telegram"""
+    user_info = get_user_contact_info(update.message.from_user)
+    
+    user_state.data["nama"] = user_message
+    user_state.data["user_id"] = user_info["user_id"]
+    user_state.data["username_tg"] = user_info["contact_info"]
+    user_state.data["contact_method"] = user_info["contact_method"]
+    user_state.data["full_name_tg"] = user_info["full_name"]
+    user_state.step = "username_website"
+    
+    website_name = user_state.data["website_name"]
+    return (
+        f"🆔 <b>Masukkan Username / ID Anda di {website_name}:</b>\n\n"
+        "✍️ <b>Ketik username atau ID Anda:</b>"
+    ), CANCEL_KEYBOARD
+
+def step_username_website(update: Update, user_state: UserState, user_message: str):
+    """Step 3: username di website"""
+    user_state.data["username_website"] = user_message
+    user_state.step = "keluhan"
+    return (
+        "📋 <b>Jelaskan keluhan Anda secara detail:</b>\n\n"
+        "✍️ <b>Ketik penjelasan keluhan:</b>"
+    ), CANCEL_KEYBOARD
+
+def step_keluhan(update: Update, user_state: UserState, user_message: str):
+    """Step 4: keluhan, lalu tawarkan bukti foto"""
+    user_state.data["keluhan"] = user_message
+    user_state.step = "bukti"
+    return BUKTI_PROMPT_TEXT, SKIP_PHOTO_KEYBOARD
+
+PENGADUAN_STEPS = {
+    "nama_website": step_nama_website,
+    "nama": step_nama,
+    "username_website": step_username_website,
+    "keluhan": step_keluhan,
+}
 
 async def handle_pengaduan_flow(update: Update, context: ContextTypes.DEFAULT_TYPE, user_message: str, user_id: int):
-    """Handle flow pengaduan - DENGAN LOCK MANAGEMENT"""
+    """Handle flow pengaduan - SATU LOCK UNTUK BACA & UPDATE STATE"""
     async with get_user_lock(user_id):
         user_state = get_user_state(user_id)
-        step = user_state.get("step", "")
+        step = user_state.step
         update_user_activity(user_id)
-    
-    logger.info(f"Pengaduan flow for user {user_id}, step: {step}")
-    
-    if step == "nama_website":
-        # VALIDASI INPUT WEBSITE
-        website_name, website_code = validate_website_input(user_message)
         
-        if website_name and website_code:
-            # Website valid, lanjutkan
-            async with get_user_lock(user_id):
-                user_state["data"]["website_name"] = website_name
-                user_state["data"]["website_code"] = website_code
-                user_state["step"] = "nama"
-                update_user_activity(user_id)
-            
-            await update.message.reply_text(
-                f"<b>{website_name}</b>\n\n"
-                "Silakan kirim <b>Nama Lengkap</b> Anda:\n\n"
-                "✍️ <b>Ketik nama lengkap:</b>",
-                parse_mode="HTML",
-                reply_markup=get_cancel_only_keyboard()
-            )
+        step_handler = PENGADUAN_STEPS.get(step)
+        if step_handler:
+            reply_text, reply_markup = step_handler(update, user_state, user_message)
+        elif step == "completed":
+            # Pengaduan sedang disimpan - state jangan di-clear
+            reply_text, reply_markup = PENGADUAN_PROCESSING_TEXT, ReplyKeyboardRemove()
         else:
-            # Website tidak valid, minta input ulang
-            await update.message.reply_text(
-                "❌ <b>Website tidak valid!</b>\n\n"
-                "Silakan tulis <b>nama website</b> yang sesuai:\n\n"
-                "✍️ <b>Tulis nama website yang benar:</b>",
-                parse_mode="HTML",
-                reply_markup=get_cancel_only_keyboard()
+            logger.warning("Unexpected step for user %s: %s", user_id, step)
+            clear_user_state(user_id)
+            reply_text = (
+                "❌ <b>Terjadi error dalam proses.</b>\n\n"
+                "Silakan mulai kembali dengan memilih menu di bawah:"
             )
-        
-    elif step == "nama":
-        # Dapatkan info user untuk disimpan
-        user_info = get_user_contact_info(update.message.from_user)
-        
-        async with get_user_lock(user_id):
-            user_state["data"]["nama"] = user_message
-            user_state["data"]["user_id"] = user_info["user_id"]
-            user_state["data"]["username_tg"] = user_info["contact_info"]
-            user_state["data"]["contact_method"] = user_info["contact_method"]
-            user_state["data"]["full_name_tg"] = user_info["full_name"]
-            user_state["step"] = "username_website"
-            update_user_activity(user_id)
-        
-        website_name = user_state["data"]["website_name"]
-        
-        await update.message.reply_text(
-            f"🆔 <b>Masukkan Username / ID Anda di {website_name}:</b>\n\n"
-            "✍️ <b>Ketik username atau ID Anda:</b>",
-            parse_mode="HTML",
-            reply_markup=get_cancel_only_keyboard()
-        )
-        
-    elif step == "username_website":
-        async with get_user_lock(user_id):
-            user_state["data"]["username_website"] = user_message
-            user_state["step"] = "keluhan"
-            update_user_activity(user_id)
-        
-        await update.message.reply_text(
-            "📋 <b>Jelaskan keluhan Anda secara detail:</b>\n\n"
-            "✍️ <b>Ketik penjelasan keluhan:</b>",
-            parse_mode="HTML",
-            reply_markup=get_cancel_only_keyboard()
-        )
-        
-    elif step == "keluhan":
-        async with get_user_lock(user_id):
-            user_state["data"]["keluhan"] = user_message
-            user_state["step"] = "bukti"
-            update_user_activity(user_id)
-        
-        await update.message.reply_text(
-            "📸 <b>Bukti Pendukung (Opsional)</b>\n\n"
-            "Pilih opsi untuk bukti:\n\n"
-            "• 📸 Kirim Foto Bukti - Unggah foto/screenshot\n"
-            "• ⏩ Lewati Tanpa Foto - Lanjut tanpa bukti\n\n"
-            "💡 <b>Rekomendasi:</b> Foto bukti membantu proses penyelesaian lebih cepat!",
-            parse_mode="HTML",
-            reply_markup=get_skip_photo_keyboard()
-        )
+            reply_markup = MAIN_MENU_KEYBOARD
     
-    else:
-        logger.warning(f"Unexpected step for user {user_id}: {step}")
-        await update.message.reply_text(
-            "❌ <b>Terjadi error dalam proses.</b>\n\n"
-            "Silakan mulai kembali dengan memilih menu di bawah:",
-            parse_mode="HTML",
-            reply_markup=get_main_menu_keyboard()
-        )
-        async with get_user_lock(user_id):
-            clear_user_state(user_id)
+    logger.info("Pengaduan flow for user %s, step: %s", user_id, step)
+    
+    # Kirim balasan di luar lock - network I/O tidak menahan lock
+    await update.message.reply_text(
+        reply_text,
+        parse_mode="HTML",
+        reply_markup=reply_markup
+    )
 
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle photo untuk bukti - VERSI DIPERBAIKI"""
     user_id = update.message.from_user.id
     
+    # Simpan file_id saja - Telegram bisa mengirim ulang foto dari file_id tanpa getFile
+    file_id = update.message.photo[-1].file_id
+    
+    # Cek step, simpan foto, tandai completed & ambil data dalam satu lock
+    data = None
     async with get_user_lock(user_id):
         user_state = get_user_state(user_id)
-        mode = user_state.get("mode")
-        step = user_state.get("step")
+        mode = user_state.mode
+        step = user_state.step
         update_user_activity(user_id)
+        if mode == "pengaduan" and step == "bukti":
+            user_state.data["bukti"] = file_id
+            user_state.data["bukti_file_id"] = file_id
+            data = take_completed_data(user_id)
+            logger.info("Photo saved for user %s, file_id: %s", user_id, file_id)
     
-    logger.info(f"Photo received from user {user_id}, mode: {mode}, step: {step}")
+    logger.info("Photo received from user %s, mode: %s, step: %s", user_id, mode, step)
     
-    if mode == "pengaduan" and step == "bukti":
+    if data is not None:
         try:
-            file_id = update.message.photo[-1].file_id
-            file_obj = await context.bot.get_file(file_id)
-            
-            async with get_user_lock(user_id):
-                user_state["data"]["bukti"] = file_obj.file_path
-                user_state["step"] = "completed"  # Mark as completed
-                update_user_activity(user_id)
-                logger.info(f"Photo saved for user {user_id}, file_path: {file_obj.file_path}")
-            
             await update.message.reply_text(
                 "✅ <b>Foto bukti berhasil diterima!</b>\n\n"
                 "🔄 <b>Menyimpan pengaduan Anda...</b>",
                 parse_mode="HTML",
                 reply_markup=ReplyKeyboardRemove()
             )
-            
-            # Beri sedikit delay untuk memastikan state tersimpan
-            await asyncio.sleep(1)
-            
-            await selesaikan_pengaduan(update, context, user_id)
-            
         except Exception as e:
-            logger.error(f"Error processing photo for user {user_id}: {e}")
+            # Konfirmasi gagal terkirim bukan alasan membatalkan pengaduan
+            logger.warning("Failed to confirm photo for user %s: %s", user_id, e)
+        
+        try:
+            await selesaikan_pengaduan(update, context, user_id, data)
+        except Exception as e:
+            # Baris mungkin sudah masuk antrian - state tidak dikembalikan supaya tidak dobel
+            logger.error("Error completing pengaduan for user %s: %s", user_id, e)
             await update.message.reply_text(
-                "❌ <b>Gagal memproses foto.</b>\n\n"
-                "Silakan coba lagi atau pilih '⏩ Lewati Tanpa Foto'.",
-                parse_mode="HTML",
-                reply_markup=get_skip_photo_keyboard()
+                "❌ Maaf, terjadi gangguan sistem. Silakan coba lagi nanti.",
+                reply_markup=MAIN_MENU_KEYBOARD
             )
+    elif step == "completed":
+        await reply_pengaduan_processing(update)
     else:
         await update.message.reply_text(
             "❌ Foto tidak diperlukan saat ini.\n\nSilakan pilih menu yang sesuai:",
-            reply_markup=get_main_menu_keyboard()
+            reply_markup=MAIN_MENU_KEYBOARD
         )
 
-async def selesaikan_pengaduan(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int):
-    """Selesaikan pengaduan dan simpan ke Google Sheets - VERSI DIPERBAIKI"""
-    logger.info(f"Starting selesaikan_pengaduan for user {user_id}")
-    
-    # Ambil data dengan lock
+def take_completed_data(user_id):
+    """Tandai pengaduan completed & lepas dict datanya dari state - panggil di dalam lock user"""
+    user_state = get_user_state(user_id)
+    # Lepas dict data dari state (tanpa copy) supaya tidak ikut termutasi handler lain
+    data = user_state.data
+    user_state.data = {}
+    user_state.step = "completed"
+    update_user_activity(user_id)
+    return data
+
+async def restore_bukti_step(user_id, data):
+    """Kembalikan data ke step bukti supaya user bisa mencoba lagi (jika belum memulai menu lain)"""
     async with get_user_lock(user_id):
         user_state = get_user_state(user_id)
-        if not user_state.get("data"):
-            logger.error(f"No data found for user {user_id}")
-            await update.message.reply_text(
-                "❌ <b>Data pengaduan tidak ditemukan.</b>\n\n"
-                "Silakan mulai kembali dari menu utama.",
-                parse_mode="HTML",
-                reply_markup=get_main_menu_keyboard()
-            )
-            clear_user_state(user_id)
-            return
-            
-        data = user_state["data"].copy()  # Copy data untuk menghindari race condition
+        if user_state.step != "completed":
+            return False
+        user_state.data = data
+        user_state.step = "bukti"
         update_user_activity(user_id)
-        logger.info(f"Data retrieved for user {user_id}: {list(data.keys())}")
+        return True
+
+async def reply_pengaduan_processing(update: Update):
+    """Balasan untuk pesan yang masuk saat pengaduan user sedang disimpan"""
+    await update.message.reply_text(
+        PENGADUAN_PROCESSING_TEXT,
+        parse_mode="HTML",
+        reply_markup=ReplyKeyboardRemove()
+    )
+
+async def selesaikan_pengaduan(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, data: dict):
+    """Selesaikan pengaduan dan simpan ke Google Sheets - data diambil via take_completed_data"""
+    logger.info("Starting selesaikan_pengaduan for user %s: %s", user_id, list(data.keys()))
     
     timestamp = get_jakarta_time()
     
     # Generate ticket number berdasarkan kode website yang valid
     website_code = data["website_code"]
-    ticket_id = generate_ticket_number(website_code)
-    
-    logger.info(f"Processing new complaint from user {user_id}: {ticket_id}")
-    
     try:
-        # Save to Google Sheets
-        worksheet.append_row([
-            timestamp,                           # Timestamp
-            ticket_id,                           # Ticket ID
-            data["website_name"],                # Website Name (yang sudah divalidasi)
-            data["nama"],                        # Nama
-            data["username_website"],            # Username Website  
-            data["keluhan"],                     # Keluhan
-            data.get("bukti", "Tidak ada bukti foto"), # Bukti
-            data["username_tg"],                 # Username_TG atau User ID
-            data["user_id"],                     # User_ID
-            data.get("contact_method", "User ID"), # Contact Method
-            data.get("full_name_tg", ""),        # Full Name Telegram
-            "Sedang diproses"                    # Status
-        ])
-        logger.info(f"✅ Data saved to Google Sheets: {ticket_id}")
-    except Exception as e:
-        logger.error(f"❌ Failed to save to Google Sheets: {e}")
+        ticket_id = await generate_ticket_number(website_code)
+    except Exception:
+        # Sheets belum bisa dibaca sejak start - tolak dulu, data dikembalikan supaya bisa dicoba lagi
+        restored = await restore_bukti_step(user_id, data)
         await update.message.reply_text(
-            "❌ Maaf, terjadi gangguan sistem. Silakan coba lagi nanti.\n\nSilakan pilih menu:",
-            reply_markup=get_main_menu_keyboard()
+            "❌ Maaf, terjadi gangguan sistem. Silakan coba lagi nanti.",
+            reply_markup=SKIP_PHOTO_KEYBOARD if restored else MAIN_MENU_KEYBOARD
         )
-        async with get_user_lock(user_id):
-            clear_user_state(user_id)
         return
+    
+    logger.info("Processing new complaint from user %s: %s", user_id, ticket_id)
+    
+    # Save to Google Sheets - lewat antrian, ditulis batch oleh _flush_loop
+    row = [
+        timestamp,                           # Timestamp
+        ticket_id,                           # Ticket ID
+        data["website_name"],                # Website Name (yang sudah divalidasi)
+        data["nama"],                        # Nama
+        data["username_website"],            # Username Website  
+        data["keluhan"],                     # Keluhan
+        data.get("bukti", "Tidak ada bukti foto"), # Bukti
+        data["username_tg"],                 # Username_TG atau User ID
+        data["user_id"],                     # User_ID
+        data.get("contact_method", "User ID"), # Contact Method
+        data.get("full_name_tg", ""),        # Full Name Telegram
+        "Sedang diproses"                    # Status
+    ]
+    await pending_rows.put(row)
+    index_new_ticket(row)
+    logger.info("📥 Data queued for Google Sheets: %s", ticket_id)
 
     # Dapatkan info user untuk success message
     user_info = get_user_contact_info(update.message.from_user)
@@ -630,184 +1122,276 @@ async def selesaikan_pengaduan(update: Update, context: ContextTypes.DEFAULT_TYP
     await update.message.reply_text(
         success_message,
         parse_mode="HTML",
-        reply_markup=get_main_menu_keyboard()
+        reply_markup=MAIN_MENU_KEYBOARD
     )
 
-    # Notify admin dengan info kontak yang lengkap
-    await kirim_notifikasi_admin_with_retry(context, data, ticket_id, timestamp, user_id)
+    # Notify admin di background - retry tidak menahan handler user.
+    # Task dari application.create_task ikut ditunggu saat bot berhenti.
+    context.application.create_task(
+        kirim_notifikasi_admin_with_retry(context, data, ticket_id, timestamp, user_id)
+    )
     
     async with get_user_lock(user_id):
-        clear_user_state(user_id)
-        logger.info(f"Pengaduan completed and state cleared for user {user_id}")
+        # Jangan hapus state baru jika user sudah memulai menu lain di tengah proses
+        user_state = user_states.get(user_id)
+        if user_state is not None and user_state.step == "completed":
+            clear_user_state(user_id)
+        logger.info("Pengaduan completed and state cleared for user %s", user_id)
+
+NOTIFY_RETRY_BASE_DELAY = 0.5  # detik
+NOTIFY_RETRY_MAX_DELAY = 10  # detik
 
 async def kirim_notifikasi_admin_with_retry(context, data, ticket_id, timestamp, user_id, retry_count=3):
-    """Kirim notifikasi ke admin dengan retry mechanism"""
+    """Kirim notifikasi ke admin dengan retry (exponential backoff) hanya ke admin yang gagal"""
+    try:
+        # Message dibangun sekali, dipakai ulang di setiap retry
+        message = build_admin_message(data, ticket_id, timestamp)
+    except Exception as e:
+        logger.error("❌ Error building admin message for ticket %s: %s", ticket_id, e)
+        return
+    bukti_file_id = data.get("bukti_file_id")
+    
+    failed = list(ADMIN_IDS)
+    gave_up = []  # admin dengan error permanen - tidak di-retry
+    sent_text = {}  # admin_id -> message_id teks yang sudah terkirim, retry hanya mengulang fotonya
     for attempt in range(retry_count):
-        try:
-            success = await kirim_notifikasi_admin(context, data, ticket_id, timestamp)
-            if success:
-                logger.info(f"✅ Notifications sent successfully for ticket {ticket_id}")
-                return
-            else:
-                logger.warning(f"⚠️ Some notifications failed for ticket {ticket_id}, attempt {attempt + 1}")
-        except Exception as e:
-            logger.error(f"❌ Error sending notifications for ticket {ticket_id}, attempt {attempt + 1}: {e}")
+        failed, permanent = await kirim_notifikasi_admin(
+            context, message, bukti_file_id, targets=failed, sent_text=sent_text
+        )
+        gave_up.extend(permanent)
+        if not failed:
+            break
+        logger.warning("⚠️ Notifications failed for %s admin(s) on ticket %s, attempt %s", len(failed), ticket_id, attempt + 1)
         
         if attempt < retry_count - 1:
-            await asyncio.sleep(2)
+            # Exponential backoff + jitter supaya retry dari banyak tiket tidak serempak
+            await asyncio.sleep(min(
+                NOTIFY_RETRY_BASE_DELAY * 2 ** attempt + random.uniform(0, NOTIFY_RETRY_BASE_DELAY),
+                NOTIFY_RETRY_MAX_DELAY
+            ))
+    else:
+        logger.error("❌ Notification attempts exhausted for ticket %s, failed admins: %s", ticket_id, failed)
     
-    logger.error(f"❌ All notification attempts failed for ticket {ticket_id}")
+    if gave_up:
+        logger.error("❌ Notifications permanently failed for ticket %s, admins: %s", ticket_id, gave_up)
+    # Admin yang sudah menerima teks tetap terhitung ternotifikasi walau fotonya gagal
+    not_notified = set(failed).union(gave_up).difference(sent_text)
+    if len(not_notified) == len(ADMIN_IDS):
+        logger.error("❌ No admin was notified for ticket %s", ticket_id)
+    elif not failed and not gave_up:
+        logger.info("✅ Notifications sent successfully for ticket %s", ticket_id)
 
-async def kirim_notifikasi_admin(context, data, ticket_id, timestamp):
-    """Send notification to admin dengan info kontak lengkap"""
-    try:
-        # Escape data untuk HTML
-        nama_escaped = escape_html(data.get("nama", ""))
-        username_website_escaped = escape_html(data.get("username_website", ""))
-        keluhan_escaped = escape_html(data.get("keluhan", ""))
-        username_tg_escaped = escape_html(data.get("username_tg", ""))
-        user_id_escaped = escape_html(data.get("user_id", ""))
-        website_escaped = escape_html(data.get("website_name", ""))
-        contact_method = data.get("contact_method", "User ID")
-        full_name_tg = escape_html(data.get("full_name_tg", ""))
-        
-        bukti_text = data.get("bukti", "Tidak ada bukti foto")
-        if bukti_text != "Tidak ada bukti foto" and bukti_text.startswith("http"):
-            bukti_display = f'<a href="{bukti_text}">📎 Lihat Bukti</a>'
-        else:
-            bukti_display = escape_html(bukti_text)
-        
-        # Buat message untuk admin dengan info kontak lengkap
-        message = (
-            f"🚨 <b>PENGADUAN BARU DITERIMA</b> 🚨\n\n"
-            f"🎫 <b>Ticket ID:</b> <code>{ticket_id}</code>\n"
-            f"🌐 <b>Website:</b> {website_escaped}\n"
-            f"⏰ <b>Waktu:</b> {timestamp} (WIB)\n\n"
-            f"<b>📋 DATA PELAPOR:</b>\n"
-            f"• <b>Nama Lengkap:</b> {nama_escaped}\n"
-            f"• <b>Username {website_escaped}:</b> {username_website_escaped}\n"
-            f"• <b>Nama Telegram:</b> {full_name_tg}\n"
-            f"• <b>Kontak Telegram:</b> {username_tg_escaped}\n"
-            f"• <b>Metode Kontak:</b> {contact_method}\n"
-            f"• <b>User ID:</b> <code>{user_id_escaped}</code>\n\n"
-            f"<b>📝 KELUHAN:</b>\n{keluhan_escaped}\n\n"
-            f"<b>📎 BUKTI:</b> {bukti_display}\n\n"
-            f"<b>📞 CARA HUBUNGI:</b>\n"
-        )
-        
-        # Tambahkan instruksi berdasarkan metode kontak
-        if "Username" in contact_method:
-            message += f"• Gunakan: <b>{username_tg_escaped}</b>\n"
-            message += f"• Atau User ID: <code>{user_id_escaped}</code>\n\n"
-        else:
-            message += f"• Gunakan User ID: <code>{user_id_escaped}</code>\n"
-            message += "• User tanpa username, gunakan ID untuk direct message\n\n"
-        
-        message += "⚠️ <b>Segera hubungi dan tindak lanjuti pengaduan ini!</b>"
-        
-        success_count = 0
-        for admin_id in ADMIN_IDS:
+# Template notifikasi admin - semua nilai sudah di-escape sebelum format_map
+ADMIN_MESSAGE_TEMPLATE = (
+    "🚨 <b>PENGADUAN BARU DITERIMA</b> 🚨\n\n"
+    "🎫 <b>Ticket ID:</b> <code>{ticket_id}</code>\n"
+    "🌐 <b>Website:</b> {website}\n"
+    "⏰ <b>Waktu:</b> {timestamp} (WIB)\n\n"
+    "<b>📋 DATA PELAPOR:</b>\n"
+    "• <b>Nama Lengkap:</b> {nama}\n"
+    "• <b>Username {website}:</b> {username_website}\n"
+    "• <b>Nama Telegram:</b> {full_name_tg}\n"
+    "• <b>Kontak Telegram:</b> {username_tg}\n"
+    "• <b>Metode Kontak:</b> {contact_method}\n"
+    "• <b>User ID:</b> <code>{user_id}</code>\n\n"
+    "<b>📝 KELUHAN:</b>\n{keluhan}\n\n"
+    "<b>📎 BUKTI:</b> {bukti}\n\n"
+    "<b>📞 CARA HUBUNGI:</b>\n"
+    "{cara_hubungi}"
+    "⚠️ <b>Segera hubungi dan tindak lanjuti pengaduan ini!</b>"
+)
+
+# Instruksi kontak berdasarkan metode kontak
+ADMIN_CONTACT_USERNAME = (
+    "• Gunakan: <b>{username_tg}</b>\n"
+    "• Atau User ID: <code>{user_id}</code>\n\n"
+)
+ADMIN_CONTACT_USER_ID = (
+    "• Gunakan User ID: <code>{user_id}</code>\n"
+    "• User tanpa username, gunakan ID untuk direct message\n\n"
+)
+
+def build_admin_message(data, ticket_id, timestamp):
+    """Bangun pesan notifikasi admin dengan info kontak lengkap"""
+    contact_method = data.get("contact_method", "User ID")
+    
+    # Escape data untuk HTML
+    fields = {
+        "ticket_id": ticket_id,
+        "timestamp": timestamp,
+        "website": escape_html(data.get("website_name", "")),
+        "nama": escape_html(data.get("nama", "")),
+        "username_website": escape_html(data.get("username_website", "")),
+        "full_name_tg": escape_html(data.get("full_name_tg", "")),
+        "username_tg": escape_html(data.get("username_tg", "")),
+        "contact_method": contact_method,
+        "user_id": escape_html(data.get("user_id", "")),
+        "keluhan": escape_html(data.get("keluhan", "")),
+    }
+    
+    if data.get("bukti_file_id"):
+        fields["bukti"] = "📸 Foto terlampir"
+    else:
+        fields["bukti"] = escape_html(data.get("bukti", "Tidak ada bukti foto"))
+    
+    if "Username" in contact_method:
+        fields["cara_hubungi"] = ADMIN_CONTACT_USERNAME.format_map(fields)
+    else:
+        fields["cara_hubungi"] = ADMIN_CONTACT_USER_ID.format_map(fields)
+    
+    return ADMIN_MESSAGE_TEMPLATE.format_map(fields)
+
+CAPTION_MAX_LENGTH = 1024  # batas caption foto Telegram (UTF-16 code unit, setelah HTML di-parse)
+_HTML_TAG_RE = re.compile(r"<[^>]+>")
+
+def telegram_text_length(html_text):
+    """Panjang teks HTML setelah di-parse Telegram, dihitung dalam UTF-16 code unit (emoji = 2)"""
+    text = html.unescape(_HTML_TAG_RE.sub("", html_text))
+    return len(text.encode("utf-16-le")) // 2
+
+async def kirim_notifikasi_admin(context, message, bukti_file_id=None, targets=None, sent_text=None):
+    """Send notification ke admin, return (admin gagal yang bisa di-retry, admin gagal permanen).
+    sent_text (admin_id -> message_id) mencatat teks yang sudah terkirim supaya retry tidak mengirim ulang"""
+    if targets is None:
+        targets = ADMIN_IDS
+    if sent_text is None:
+        sent_text = {}
+    
+    # Satu send_photo dengan caption jika muat
+    caption_fits = telegram_text_length(message) <= CAPTION_MAX_LENGTH
+    
+    async def kirim_ke_admin(admin_id):
+        if bukti_file_id and caption_fits and admin_id not in sent_text:
             try:
-                await context.bot.send_message(
+                await context.bot.send_photo(
                     chat_id=admin_id,
-                    text=message,
-                    parse_mode="HTML",
-                    disable_web_page_preview=True
+                    photo=bukti_file_id,
+                    caption=message,
+                    parse_mode="HTML"
                 )
-                success_count += 1
-                logger.info(f"✅ Notification sent to admin {admin_id}")
-            except Exception as e:
-                logger.error(f"❌ Failed to send to admin {admin_id}: {e}")
-        
-        logger.info(f"📊 Notifications sent to {success_count}/{len(ADMIN_IDS)} admins")
-        return success_count > 0
-        
-    except Exception as e:
-        logger.error(f"❌ Error in kirim_notifikasi_admin: {e}")
-        return False
+                return
+            except BadRequest as e:
+                # Caption tetap ditolak - kirim teks + foto terpisah
+                logger.warning("⚠️ Caption rejected for admin %s, sending text + photo: %s", admin_id, e)
+        if admin_id not in sent_text:
+            sent = await context.bot.send_message(
+                chat_id=admin_id,
+                text=message,
+                parse_mode="HTML",
+                disable_web_page_preview=True
+            )
+            sent_text[admin_id] = sent.message_id
+        if bukti_file_id:
+            await context.bot.send_photo(
+                chat_id=admin_id,
+                photo=bukti_file_id,
+                reply_to_message_id=sent_text[admin_id]
+            )
+    
+    results = await asyncio.gather(*[
+        kirim_ke_admin(admin_id) for admin_id in targets
+    ], return_exceptions=True)
+    
+    failed = []
+    permanent = []
+    for admin_id, result in zip(targets, results):
+        if isinstance(result, (BadRequest, Forbidden)):
+            # Error permanen (chat tidak valid / bot diblokir) - tidak perlu di-retry
+            permanent.append(admin_id)
+            logger.error("❌ Failed to send to admin %s (not retried): %s", admin_id, result)
+        elif isinstance(result, Exception):
+            failed.append(admin_id)
+            logger.error("❌ Failed to send to admin %s: %s", admin_id, result)
+        else:
+            logger.info("✅ Notification sent to admin %s", admin_id)
+    
+    sent_count = sum(not isinstance(result, Exception) for result in results)
+    logger.info("📊 Notifications sent to %s/%s admins", sent_count, len(targets))
+    return failed, permanent
+
+# Template pesan status tiket - semua nilai sudah di-escape sebelum format_map
+STATUS_MESSAGE_TEMPLATE = (
+    "📋 <b>STATUS PENGADUAN</b>\n\n"
+    "{status_emoji} <b>Status:</b> <b>{status}</b>\n"
+    "🎫 <b>Ticket ID:</b> <code>{ticket_id}</code>\n"
+    "🌐 <b>Website:</b> {website}\n"
+    "👤 <b>Nama:</b> {nama}\n"
+    "🆔 <b>Username:</b> {username}\n"
+    "💬 <b>Keluhan:</b> {keluhan}\n"
+    "⏰ <b>Waktu:</b> {timestamp}\n\n"
+    "Terima kasih telah menggunakan layanan kami! 🙏"
+)
+
+# Placeholder template -> kolom sheet
+STATUS_MESSAGE_FIELDS = (
+    ("website", "Nama Website"),
+    ("nama", "Nama"),
+    ("username", "Username Website"),
+    ("keluhan", "Keluhan"),
+    ("timestamp", "Timestamp"),
+)
+
+STATUS_EMOJI = {
+    'Sedang diproses': '🟡',
+    'Selesai': '✅',
+    'Ditolak': '❌',
+    'Menunggu konfirmasi': '🟠'
+}
 
 async def proses_cek_status(update: Update, context: ContextTypes.DEFAULT_TYPE, ticket_id: str, user_id: int):
     """Proses cek status tiket - TERPISAH DARI STATE PENGADUAN"""
     current_user_id = user_id
     
     try:
-        all_data = worksheet.get_all_records()
-        found = False
-        user_owns_ticket = False
-        ticket_data = None
+        # Input yang bentuknya bukan Ticket ID tidak perlu memicu refresh index
+        ticket_data = await get_ticket_record(ticket_id) if TICKET_ID_RE.match(ticket_id) else None
         
-        for row in all_data:
-            if row.get('Ticket ID') == ticket_id:
-                found = True
-                ticket_user_id = row.get('User_ID')
-                if str(ticket_user_id) == str(current_user_id):
-                    user_owns_ticket = True
-                    ticket_data = row
-                break
-        
-        if found and user_owns_ticket and ticket_data:
+        # Tiket hanya ditampilkan ke pemiliknya
+        if ticket_data and str(ticket_data.get('User_ID')) == str(current_user_id):
             status = ticket_data.get('Status', 'Tidak diketahui')
-            status_emoji = {
-                'Sedang diproses': '🟡',
-                'Selesai': '✅',
-                'Ditolak': '❌',
-                'Menunggu konfirmasi': '🟠'
-            }.get(status, '⚪')
-            
-            nama_escaped = escape_html(ticket_data.get('Nama', 'Tidak ada'))
-            username_escaped = escape_html(ticket_data.get('Username Website', 'Tidak ada'))
-            keluhan_escaped = escape_html(ticket_data.get('Keluhan', 'Tidak ada'))
-            timestamp_escaped = escape_html(ticket_data.get('Timestamp', 'Tidak ada'))
-            website_escaped = escape_html(ticket_data.get('Nama Website', 'Tidak ada'))
-            
-            status_message = (
-                f"📋 <b>STATUS PENGADUAN</b>\n\n"
-                f"{status_emoji} <b>Status:</b> <b>{status}</b>\n"
-                f"🎫 <b>Ticket ID:</b> <code>{ticket_id}</code>\n"
-                f"🌐 <b>Website:</b> {website_escaped}\n"
-                f"👤 <b>Nama:</b> {nama_escaped}\n"
-                f"🆔 <b>Username:</b> {username_escaped}\n"
-                f"💬 <b>Keluhan:</b> {keluhan_escaped}\n"
-                f"⏰ <b>Waktu:</b> {timestamp_escaped}\n\n"
-                f"Terima kasih telah menggunakan layanan kami! 🙏"
-            )
+            fields = {
+                key: escape_html(ticket_data.get(column, 'Tidak ada'))
+                for key, column in STATUS_MESSAGE_FIELDS
+            }
+            status_message = STATUS_MESSAGE_TEMPLATE.format_map({
+                **fields,
+                "status_emoji": STATUS_EMOJI.get(status, '⚪'),
+                "status": escape_html(status),
+                "ticket_id": ticket_id,
+            })
             
             await update.message.reply_text(
                 status_message,
                 parse_mode="HTML",
-                reply_markup=get_main_menu_keyboard()
+                reply_markup=MAIN_MENU_KEYBOARD
             )
         else:
             await update.message.reply_text(
-                "❌ <b>Tiket tidak ditemukan.</b>\n\n"
-                "Pastikan:\n"
-                "• Nomor tiket benar\n"
-                "• Tidak ada typo\n"
-                "• Tiket milik Anda sendiri\n\n"
-                "Silakan coba lagi:",
+                TICKET_NOT_FOUND_TEXT,
                 parse_mode="HTML",
-                reply_markup=get_main_menu_keyboard()
+                reply_markup=MAIN_MENU_KEYBOARD
             )
             
     except Exception as e:
-        logger.error(f"Error checking status: {e}")
+        logger.error("Error checking status: %s", e)
         await update.message.reply_text(
             "❌ Terjadi error. Silakan coba lagi.\n\nSilakan pilih menu:",
             parse_mode="HTML",
-            reply_markup=get_main_menu_keyboard()
+            reply_markup=MAIN_MENU_KEYBOARD
         )
     
     async with get_user_lock(current_user_id):
-        clear_user_state(current_user_id)
+        # Jangan hapus state baru jika user sudah memulai menu lain selama lookup/balasan
+        user_state = user_states.get(current_user_id)
+        if user_state is not None and user_state.mode == "cek_status" and user_state.step == "input_tiket":
+            clear_user_state(current_user_id)
 
 async def show_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Tampilkan menu utama"""
     await update.message.reply_text(
-        "🤖 <b>Layanan Pengaduan Customer Service</b>\n\n"
-        "Kami siap membantu masalah Anda.\n\n"
-        "👇 <b>Silakan pilih menu:</b>",
+        MENU_TEXT,
         parse_mode="HTML",
-        reply_markup=get_main_menu_keyboard()
+        reply_markup=MAIN_MENU_KEYBOARD
     )
 
 async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -816,13 +1400,22 @@ async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle error"""
-    logger.error(f"Error: {context.error}")
+    logger.error("Error: %s", context.error)
     if update and update.message:
         await update.message.reply_text(
             "❌ Terjadi error, silakan coba lagi.\n\nSilakan pilih menu:",
-            reply_markup=get_main_menu_keyboard()
+            reply_markup=MAIN_MENU_KEYBOARD
         )
 
+# Bot hanya memproses message (teks, foto, command)
+ALLOWED_UPDATES = [Update.MESSAGE]
+
+# Jumlah update yang diproses bersamaan. Update dari user yang sama juga bisa berjalan
+# bersamaan - lock user hanya menjaga tiap baca/ubah state tetap atomic (tidak pernah
+# dipegang melewati network I/O), jadi tidak mengurutkan update. Handler yang
+# menghapus state di akhir harus cek dulu state-nya belum diganti update lain
+CONCURRENT_UPDATES = 256
+
 def main():
     """Main function"""
     if not BOT_TOKEN:
@@ -833,12 +1426,25 @@ def main():
         logger.error("GOOGLE_CREDENTIALS not found!")
         return
 
-    if not worksheet:
-        logger.error("Google Sheets not connected!")
-        return
-
     try:
-        application = Application.builder().token(BOT_TOKEN).post_init(post_init).build()
+        application = (
+            Application.builder()
+            .token(BOT_TOKEN)
+            .concurrent_updates(CONCURRENT_UPDATES)
+            .rate_limiter(AIORateLimiter(
+                overall_max_rate=28, overall_time_period=1,
+                group_max_rate=18, group_time_period=60,
+                max_retries=3
+            ))
+            .connection_pool_size(256)
+            .pool_timeout(30)
+            .get_updates_connection_pool_size(8)
+            .http_version("2")
+            .get_updates_http_version("2")
+            .post_init(post_init)
+            .post_shutdown(post_shutdown)
+            .build()
+        )
         
         # Command handlers
         application.add_handler(CommandHandler("start", start))
@@ -850,18 +1456,31 @@ def main():
         
         # Message handlers
         application.add_handler(MessageHandler(filters.PHOTO, handle_photo))
+        application.add_handler(MessageHandler(filters.Regex(BUTTON_RE), handle_menu_button))
         application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
         
         application.add_error_handler(error_handler)
         
         logger.info("✅ Enhanced Complaint Bot with Contact Info starting...")
-        application.run_polling(
-            drop_pending_updates=True,
-            allowed_updates=Update.ALL_TYPES
-        )
+        if WEBHOOK_URL:
+            # Webhook: update langsung dikirim Telegram, tanpa jeda long-poll getUpdates
+            application.run_webhook(
+                listen="0.0.0.0",
+                port=PORT,
+                url_path=WEBHOOK_PATH,
+                webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET,
+                drop_pending_updates=True,
+                allowed_updates=ALLOWED_UPDATES
+            )
+        else:
+            application.run_polling(
+                drop_pending_updates=True,
+                allowed_updates=ALLOWED_UPDATES
+            )
         
     except Exception as e:
-        logger.error(f"Fatal error: {e}")
+        logger.error("Fatal error: %s", e)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file